@@ -29,6 +29,7 @@ from bpy.props import (
         BoolProperty,
         EnumProperty,
         FloatProperty,
+        IntProperty,
         StringProperty,
         CollectionProperty,
         )
@@ -37,6 +38,18 @@ from bpy_extras.io_utils import (
         ExportHelper,
         )
 
+# generators of the modal imports that are currently running
+ACTIVE_IMPORTS = set()
+
+@bpy.app.handlers.persistent
+def stop_active_imports(*args):
+    """
+    undo, redo and loading a file free every ID a running import references, so wrap the imports up while those are still valid
+    """
+    for steps in list(ACTIVE_IMPORTS):
+        steps.close()
+    ACTIVE_IMPORTS.clear()
+
 class ImportN8PNG(bpy.types.Operator, ImportHelper):
     """Import from png and ncd file format (.png, .ncd)"""
     bl_idname = "import_n8.files"
@@ -44,6 +57,21 @@ class ImportN8PNG(bpy.types.Operator, ImportHelper):
     bl_options = {'UNDO'}
 
     filter_glob: StringProperty(default="*.png;*.ncd", options={'HIDDEN'})
+
+    use_modal: BoolProperty(
+        name="Keep Editor Responsive",
+        description="Import in small batches so the editor stays usable, press Esc to stop early and keep what was imported so far",
+        default=False,
+    )
+    batch_size: IntProperty(
+        name="Batch Size",
+        description="Number of blocks or pixels created per update when keeping the editor responsive",
+        default=20,
+        min=1,
+    )
+
+    _timer = None
+    _steps = None
         
     def execute(self, context):
         from pathlib import Path
@@ -56,6 +84,14 @@ class ImportN8PNG(bpy.types.Operator, ImportHelper):
         print('Selected file:', self.filepath)
         print('File name:', filename)
         print('File extension:', extension)
+        if self.use_modal:
+            # the steps run later on from modal, so pin the collection that's active right now
+            collection = context.collection
+            if extension == ".png":
+                return self.start_modal(context, import_n8png.load_steps(collection, self.filepath))
+            elif extension == ".ncd":
+                return self.start_modal(context, import_n8ncd.load_steps(collection, self.filepath))
+
         if extension == ".png":
             import_n8png.load(context, self.filepath)
         elif extension == ".ncd":
@@ -63,18 +99,118 @@ class ImportN8PNG(bpy.types.Operator, ImportHelper):
 
         return {'FINISHED'}
 
+    def start_modal(self, context, steps):
+        wm = context.window_manager
+        self._steps = steps
+        ACTIVE_IMPORTS.add(steps)
+        self._timer = wm.event_timer_add(0.01, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def finish_modal(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        ACTIVE_IMPORTS.discard(self._steps)
+        self._timer = None
+        self._steps = None
+        # finished rather than cancelled, so the partial result still gets its undo step
+        return {'FINISHED'}
+
+    def cancel(self, context):
+        # the handler was removed from outside, e.g. by loading another file; stop_active_imports already wrapped it up
+        self._steps.close()
+        self.finish_modal(context)
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            # closing the generator lets the importer parent whatever it created so far
+            self._steps.close()
+            self.report({'WARNING'}, "Import stopped early, keeping what was imported so far")
+            return self.finish_modal(context)
+
+        if event.type != 'TIMER' or event.timer != self._timer:
+            return {'PASS_THROUGH'}
+
+        try:
+            for i in range(self.batch_size):
+                done, total = next(self._steps)
+        except StopIteration:
+            return self.finish_modal(context)
+        except Exception:
+            self._steps.close()
+            self.finish_modal(context)
+            raise
+
+        context.window_manager.progress_update(100 * done / total if total else 100)
+        return {'PASS_THROUGH'}
+
+class ScanN8Files(bpy.types.Operator):
+    """Scan a directory of png and ncd files for anything the importer can't handle, without importing them"""
+    bl_idname = "import_n8.scan"
+    bl_label = 'Scan N8* Files (*.png;*.ncd)'
+
+    directory: StringProperty(subtype='DIR_PATH')
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        from . import scan_n8
+
+        reports = scan_n8.scan_directory(self.directory)
+        for report in reports:
+            print(report)
+
+        failed = sum(1 for report in reports if report.problems)
+        self.report(
+            {'WARNING'} if failed else {'INFO'},
+            f"Scanned {len(reports)} files, {failed} with problems (details are in the system console)"
+        )
+
+        return {'FINISHED'}
+
+class BuildStuffLibrary(bpy.types.Operator):
+    """Import every data/stuff model once into a prebuilt library that ncd imports instance blocks from"""
+    bl_idname = "import_n8.build_stuff_library"
+    bl_label = 'Build N8* Stuff Library'
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_confirm(self, event)
+
+    def execute(self, context):
+        from . import stuff_library
+
+        built, skipped = stuff_library.build()
+        self.report({'INFO'}, f"Built {built} models into {stuff_library.LIBRARY_PATH}, skipped {skipped}")
+
+        return {'FINISHED'}
+
 def menu_func_import(self, context):
     self.layout.operator(ImportN8PNG.bl_idname, text=ImportN8PNG.bl_label)
+    self.layout.operator(ScanN8Files.bl_idname, text=ScanN8Files.bl_label)
+    self.layout.operator(BuildStuffLibrary.bl_idname, text=BuildStuffLibrary.bl_label)
 
 def register():
 	from bpy.utils import register_class
 	register_class(ImportN8PNG)
+	register_class(ScanN8Files)
+	register_class(BuildStuffLibrary)
 	bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+	for handlers in (bpy.app.handlers.undo_pre, bpy.app.handlers.redo_pre, bpy.app.handlers.load_pre):
+		handlers.append(stop_active_imports)
 		
 def unregister():
 	from bpy.utils import unregister_class
 	unregister_class(ImportN8PNG)
+	unregister_class(ScanN8Files)
+	unregister_class(BuildStuffLibrary)
 	bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+	for handlers in (bpy.app.handlers.undo_pre, bpy.app.handlers.redo_pre, bpy.app.handlers.load_pre):
+		if stop_active_imports in handlers:
+			handlers.remove(stop_active_imports)
 
 if __name__ == "__main__":
     register()
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+Batched parent/child matrix resolution shared by the model and cell importers.
+
+Nothing in here touches bpy; the importers build a local matrix and a parent index for every object,
+resolve them all at once and then write each object's matrices a single time.
+"""
+import numpy as np
+
+def quaternions_to_matrices(quats):
+    """
+    converts an (n, 4) array of WXYZ quaternions to an (n, 3, 3) array of rotation matrices
+    """
+    # normalize first; the saved quaternions are only approximately unit length
+    quats = quats / np.linalg.norm(quats, axis=1, keepdims=True)
+    w, x, y, z = quats.T
+
+    rot = np.empty((len(quats), 3, 3))
+    rot[:, 0, 0] = 1 - 2*(y*y + z*z)
+    rot[:, 0, 1] = 2*(x*y - z*w)
+    rot[:, 0, 2] = 2*(x*z + y*w)
+    rot[:, 1, 0] = 2*(x*y + z*w)
+    rot[:, 1, 1] = 1 - 2*(x*x + z*z)
+    rot[:, 1, 2] = 2*(y*z - x*w)
+    rot[:, 2, 0] = 2*(x*z - y*w)
+    rot[:, 2, 1] = 2*(y*z + x*w)
+    rot[:, 2, 2] = 1 - 2*(x*x + y*y)
+    return rot
+
+def local_matrices(positions, rotations, scales = None):
+    """
+    builds an (n, 4, 4) array of translation @ rotation @ scale matrices from positions, WXYZ quaternions and scales
+    """
+    rotations = np.asarray(rotations, dtype=float).reshape(-1, 4)
+
+    local = np.zeros((len(rotations), 4, 4))
+    local[:, :3, :3] = quaternions_to_matrices(rotations)
+    if scales is not None:
+        local[:, :3, :3] *= np.asarray(scales, dtype=float).reshape(-1, 1, 3)
+    local[:, :3, 3] = np.asarray(positions, dtype=float).reshape(-1, 3)
+    local[:, 3, 3] = 1.0
+    return local
+
+def resolve(local, parents):
+    """
+    works out the world matrix of every object through its parent chain, given their local matrices and the index of
+    each one's parent (-1 for roots).
+
+    returns (world, parent_inverse, parents, in_loop, under_loop). parent_inverse is the inverse of the parent's world
+    matrix, so parenting with it and using the world matrix as the basis keeps every object where it belongs.
+    objects that are part of a parent loop, or attached somewhere below one, can't be resolved; they keep their local
+    matrix, are flagged in in_loop/under_loop and have their parent removed from the returned parents
+    """
+    parents = np.asarray(parents, dtype=np.int64)
+    count = len(parents)
+
+    # pointer jumping: every pass folds in the matrix of the furthest ancestor found so far,
+    # so a chain of depth d only needs log2(d) batched multiplies
+    world = local.copy()
+    ancestor = parents.copy()
+    for _ in range(count.bit_length() + 1):
+        pending = ancestor >= 0
+        if not pending.any():
+            break
+        world[pending] = world[ancestor[pending]] @ world[pending]
+        ancestor[pending] = ancestor[ancestor[pending]]
+
+    # anything still waiting on an ancestor has jumped more steps than there are objects, so it's sitting on a loop now.
+    # every object on a loop is reached that way, so whatever isn't reached is only attached below one
+    looped = ancestor >= 0
+    in_loop = np.zeros(count, dtype=bool)
+    in_loop[ancestor[looped]] = True
+    under_loop = looped & ~in_loop
+
+    world[looped] = local[looped]
+    parents = np.where(looped, -1, parents)
+
+    parent_inverse = np.broadcast_to(np.identity(4), local.shape).copy()
+    parented = parents >= 0
+    if parented.any():
+        parent_inverse[parented] = np.linalg.inv(world[parents[parented]])
+
+    return world, parent_inverse, parents, in_loop, under_loop
@@ -1,13 +1,19 @@
 import os, io
 import bpy
+import numpy as np
 from pathlib import Path
-from mathutils import Color, Quaternion
+from mathutils import Color, Matrix, Quaternion
+from . import read_n8ncd, hierarchy
 
 SCALE_CONVERSION:float = 1.0/100.0
 
 class CellBlock:
     mesh_name = None
-    mesh = None
+    # only the name of the created object is kept; undo, deleting objects and loading a file free it without
+    # invalidating python references, which matters once an import is spread out over several updates
+    object_name = None
+    parser = None
+    library_collection = None
     name = None
     position = None
     rotation = None
@@ -21,43 +27,70 @@ class CellBlock:
     def __repr__(self):
         return f"mesh_name: {self.mesh_name} | name: {self.name} | position: {self.position} | rotation: {self.rotation}"
 
-    def load_mesh(self, context):
+    def mesh_path(self) -> Path:
+        filepath = os.path.dirname(os.path.realpath(__file__))
+        return Path(filepath) / "data" / "stuff" / (self.mesh_name.lower() + ".png")
+
+    def parse_mesh(self):
         from . import import_n8png
 
-        filepath = os.path.dirname(os.path.realpath(__file__))
-        filepath = str(Path(filepath) / "data" / "stuff" / self.mesh_name.lower()) + ".png"
-        result, block = import_n8png.load(context, filepath)
+        try:
+            self.parser, version = import_n8png.parse_file(str(self.mesh_path()))
+        except import_n8png.UnsupportedFiletype as e:
+            # leave just this block out instead of the whole cell
+            print(f"Skipping block {self.name}: {e}")
+            return False
+        return self.parser is not None
+
+    def load_mesh(self, collection, name:str):
+        from . import import_n8png, stuff_library
+
+        if self.library_collection is not None:
+            block = stuff_library.instance_collection(collection, self.library_collection, name)
+        else:
+            if self.parser is None and not self.parse_mesh():
+                return False
+
+            # named up front so the block origin the parser keeps track of doesn't get renamed afterwards
+            self.parser.display_name = name
+            block = import_n8png.create(collection, self.parser, self.mesh_path().stem)
 
         if block:
-            self.mesh = block
-            self.mesh.location = self.position
-            self.mesh.rotation_quaternion = self.rotation
+            # positioned later on along with its parent in resolve_attachments
+            self.object_name = block.name
             return True
         else:
             return False
 
-    def set_parent(self, parent):
-        self.mesh.parent = parent.mesh
-        self.mesh.location = self.position
-        self.mesh.rotation_quaternion = self.rotation
-
 class N8Cell:
     blocks = None
     tronics = None
+    wires = None
+    attachments = None
+    skipped = None
 
     def __init__(self):
         self.blocks = {}
         self.tronics = {}
+        self.wires = []
+        self.attachments = {}
+        # (section, line) of every record that couldn't be parsed
+        self.skipped = []
 
     def add_block(self, index, block):
         self.blocks[index] = block
 
     def load(self, context, filepath):
+        self.parse(filepath)
+        self.create(context.collection)
+
+    def parse(self, filepath):
+        """
+        reads every section of the cell without creating anything in the scene
+        """
         current_parse = "blocks"
         with open(filepath, mode='r', errors='ignore') as n8file:
-            for line in n8file:
-                stripped = line.strip()
-
+            for stripped in read_n8ncd.join_wrapped(n8file):
                 if stripped == "tronics":
                     current_parse = stripped
                     continue
@@ -69,22 +102,57 @@ class N8Cell:
                     continue
 
                 if current_parse == "blocks":
-                    block, index = self.parse_block(stripped)
-                    if block.load_mesh(context):
-                        block.mesh.name = f"{index} - {block.mesh_name}"
+                    self.parse_block(stripped)
                 
                 if current_parse =="attach":
                     self.parse_attach(stripped)
 
                 if current_parse == "tronics":
-                    pass
+                    self.parse_tronic(stripped)
                     
                 if current_parse == "wire":
-                    pass
+                    self.parse_wire(stripped)
+
+    def create(self, collection):
+        for step in self.create_steps(collection):
+            pass
+
+    def create_steps(self, collection):
+        """
+        parses every model and then creates the blocks one at a time, yielding (done, total) after each.
+        closing the generator early still attaches every block created up to that point
+        """
+        from . import import_n8png, stuff_library
+
+        total = len(self.blocks) * 2
+
+        # models that are up to date in the prebuilt library get instanced from there instead
+        library = stuff_library.link_collections(block.mesh_path() for block in self.blocks.values())
+
+        # parse every other model first so all of the textures can be loaded together up front
+        texture_paths = set()
+        for i, block in enumerate(self.blocks.values()):
+            block.library_collection = library.get(block.mesh_path())
+            if block.library_collection is None and block.parse_mesh():
+                texture_paths |= block.parser.texture_paths()
+            yield i + 1, total
+        import_n8png.preload_textures(texture_paths)
+
+        try:
+            for i, (index, block) in enumerate(self.blocks.items()):
+                block.load_mesh(collection, f"{index} - {block.mesh_name}")
+                yield len(self.blocks) + i + 1, total
+        finally:
+            self.resolve_attachments()
 
     def parse_block(self, block_line):
         # 185:landmega:landmega:-1600,0,1600:0.7071068,1.545522E-08,-0.7071067,1.545522E-08:0
         split = block_line.split(sep=":")
+        if len(split) < 5:
+            print(f"Skipping malformed block line {block_line}")
+            self.skipped.append(("block", block_line))
+            return None, None
+
         index = split[0]
         mesh_name = split[1]
         name = split[2]
@@ -114,17 +182,87 @@ class N8Cell:
         child = split[0]
         parent = split[1]
 
-        if child in self.blocks and parent in self.blocks:
-            self.blocks[child].set_parent(self.blocks[parent])
-        else:
-            print(f"Tried to attach {child} to {parent} but one of them didn't exist?")
+        self.attachments[child] = parent
+
+    def resolve_attachments(self):
+        """
+        positions and parents every loaded block in one go.
+
+        attach positions are relative to the parent block, so the world matrix of every block is
+        built up through its parent chain in a single batched pass. each block then gets its world
+        matrix as its basis with the inverse of its parent's world matrix as the parent inverse,
+        written once per block.
+        """
+        from . import import_n8png
+
+        # looked up again since the editor may have run in between the steps, deleting some of them
+        objects = import_n8png.objects_by_name()
+        found = {
+            index: objects[block.object_name] for index, block in self.blocks.items()
+            if block.object_name in objects
+        }
+
+        ids = list(found)
+        if not ids:
+            return
+        lookup = {index: i for i, index in enumerate(ids)}
 
+        parents = np.full(len(ids), -1, dtype=np.int64)
+        for child, parent in self.attachments.items():
+            if child in lookup and parent in lookup:
+                parents[lookup[child]] = lookup[parent]
+            else:
+                print(f"Tried to attach {child} to {parent} but one of them didn't exist?")
+
+        local = hierarchy.local_matrices(
+            [self.blocks[index].position for index in ids],
+            [tuple(self.blocks[index].rotation) for index in ids],
+        )
+        world, parent_inverse, resolved, in_loop, under_loop = hierarchy.resolve(local, parents)
+
+        # anything in or under a loop is left unparented
+        for i in np.flatnonzero(in_loop):
+            print(f"Tried to attach {ids[i]} to {ids[parents[i]]} but they're attached in a loop?")
+        for i in np.flatnonzero(under_loop):
+            print(f"Tried to attach {ids[i]} to {ids[parents[i]]} but the chain above it ends in a loop?")
+
+        # every block gets its whole transform written once
+        for i, index in enumerate(ids):
+            block = found[index]
+            block.parent = found[ids[resolved[i]]] if resolved[i] >= 0 else None
+            block.matrix_parent_inverse = Matrix(parent_inverse[i].tolist())
+            block.matrix_basis = Matrix(world[i].tolist())
 
     def parse_tronic(self, data:str):
-        pass
+        # the geometry doesn't depend on the tronics, so a broken record shouldn't stop the import
+        try:
+            tronic = read_n8ncd.parse_tronic(data)
+        except ValueError:
+            print(f"Skipping malformed tronic line {data}")
+            self.skipped.append(("tronic", data))
+            return
+        self.tronics[tronic.index] = tronic
 
     def parse_wire(self, data:str):
-        pass
+        try:
+            wire = read_n8ncd.parse_wire(data)
+        except ValueError:
+            print(f"Skipping malformed wire line {data}")
+            self.skipped.append(("wire", data))
+            return
+        self.wires.append(wire)
+
+    def wire_graph(self) -> read_n8ncd.WireGraph:
+        return read_n8ncd.WireGraph(self.tronics.values(), self.wires)
+
+def load_steps(collection, filepath:str):
+    """
+    same as load, but yields (done, total) as the blocks are created so the caller can spread the import out and stop it early.
+    the collection is passed in rather than read from a context, since the active one can change in the meantime
+    """
+    cell = N8Cell()
+    cell.parse(filepath)
+    yield from cell.create_steps(collection)
 
 def load(context, filepath:str, scale:float = 1.0):
     cell = N8Cell()
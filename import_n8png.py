@@ -1,9 +1,11 @@
 import bpy, bmesh
 import time, struct, os, io
 from pathlib import Path
-from mathutils import Color, Quaternion, Vector
+from mathutils import Color, Matrix, Quaternion, Vector
 import math
 import re
+import numpy as np
+from . import hierarchy
 
 SCALE_CONVERSION:float = 1.0/100.0
 
@@ -14,6 +16,8 @@ PIXEL_SCALE = {
 }
 
 MESH_CACHE = {}
+LIBRARY_CACHE = {}
+TEXTURE_CACHE = {}
 
 # https://docs.blender.org/api/current/bpy.types.Material.html
 # https://docs.blender.org/api/current/bpy.types.MaterialSlot.html
@@ -39,78 +43,142 @@ def load_file(filepath, context) -> (str,str):
             version = "BEGIN!"
         if index == -1:
             print("This file format isn't supported")
-            return
+            return None, "UNKNOWN"
             
         data = data[index:]
 
     return data, version
 
-class N8Mesh():
-    model:str = None
-    mesh = None
-    pivot = None
-
-    def __init__(self, model:str):
-        self.model = model
-        self.create()
-
-    def set_name(self, name:str):
-        self.mesh.name = name
-        self.pivot.name = f"{name} Pivot"
-
-    def set_position(self, vector:tuple):
-        self.pivot.location = vector
+def get_library_object(model:str):
+    """
+    appends the model from librarypixel.blend once and returns it, reusing the appended object afterwards.
+    only the name is cached since undo and loading a file free the object without invalidating python references to it
+    """
+    obj = bpy.data.objects.get(LIBRARY_CACHE.get(model, ""))
+    if obj is not None and obj.get("n8_library_model") == model:
+        return obj
+
+    filepath = os.path.dirname(os.path.realpath(__file__))
+    filepath = str(Path(filepath) / "librarypixel.blend")
+    with bpy.data.libraries.load(filepath=filepath, link=False) as (data_from, data_to):
+        data_to.objects = [name for name in data_from.objects if name == model]
+
+    for obj in data_to.objects:
+        if obj is not None:
+            # tagged so a user object that happens to get the same name isn't mistaken for it
+            obj["n8_library_model"] = model
+            LIBRARY_CACHE[model] = obj.name
+            return obj
+
+def get_cached_texture(image_path:str):
+    """
+    only the name is cached since undo and loading a file free the image without invalidating python references to it
+    """
+    image = bpy.data.images.get(TEXTURE_CACHE.get(image_path, ""))
+    if image is not None and image.get("n8_texture_path") == image_path:
+        return image
+    return None
 
-    def set_offset(self, vector:tuple):
-        self.mesh.location = vector
+def cache_texture(image_path:str, image):
+    image["n8_texture_path"] = image_path
+    TEXTURE_CACHE[image_path] = image.name
 
-    def set_scale(self, vector:tuple):
-        self.mesh.scale = vector
-        #bpy.ops.object.select_all(action='DESELECT')
-        #self.mesh.select_set(True)
-        #bpy.context.view_layer.objects.active = self.mesh
-        #bpy.ops.object.transform_apply(location = False, scale = True, rotation = False)
-        #bpy.ops.object.select_all(action='DESELECT')
+def read_texture(image_path:str):
+    try:
+        with open(image_path, mode='rb') as image_file:
+            return image_file.read()
+    except OSError as e:
+        print(f"Couldn't read {image_path}: {e}")
+        return None
 
-    def set_rotation(self, quat:Quaternion):
-        self.pivot.rotation_quaternion = quat
+def preload_textures(image_paths):
+    """
+    creates a packed image for every texture that isn't loaded yet, reading each file only once
+    """
+    pending = sorted({
+        str(image_path) for image_path in image_paths
+        if get_cached_texture(str(image_path)) is None and os.path.isfile(image_path)
+    })
+    if not pending:
+        return
+
+    print(f"Loading {len(pending)} textures")
+    for image_path in pending:
+        data = read_texture(image_path)
+        if data is None:
+            # load_texture falls back to bpy.data.images.load
+            continue
+
+        # packing the file contents and switching the source to FILE makes blender decode them with its own png
+        # loader, exactly like bpy.data.images.load + pack but without reading the file from disk twice
+        image = bpy.data.images.new(Path(image_path).name, 8, 8)
+        image.pack(data=data, data_len=len(data))
+        image.source = 'FILE'
+        image.filepath_raw = image_path
+        cache_texture(image_path, image)
+
+def matrix_to_root(obj, root) -> Matrix:
+    matrix = Matrix.Identity(4)
+    while obj is not None and obj != root:
+        matrix = obj.matrix_parent_inverse @ obj.matrix_basis @ matrix
+        obj = obj.parent
+    return matrix
+
+def objects_by_name() -> dict:
+    """
+    every local object keyed by name, built in one pass so looking up what an import created doesn't search
+    bpy.data.objects once per object
+    """
+    return {obj.name: obj for obj in bpy.data.objects if obj.library is None}
 
-    def set_local_rotation(self, quat:Quaternion):
-        self.mesh.rotation_quaternion = quat
+class N8Mesh():
+    model:str = None
+    # only the names are kept; undo, deleting objects and loading a file free them without invalidating python
+    # references, which matters once an import is spread out over several updates
+    mesh_name:str = None
+    pivot_name:str = None
 
-    def set_parent(self, target):
-        self.pivot.parent = target
+    def __init__(self, model:str):
+        self.model = model
 
-    def get_pivot(self):
-        return self.pivot
+    def find(self, objects:dict) -> tuple:
+        """
+        returns the (pivot, mesh) objects from a dict built by objects_by_name, either being None if it's gone
+        """
+        return objects.get(self.pivot_name), objects.get(self.mesh_name)
 
-    def create(self, model:str=None):
+    def create(self, model:str=None, collection=None, name:str=None):
         if model:
             self.model = model
-
-        self.pivot = bpy.data.objects.new( "empty", None )
-        bpy.context.collection.objects.link(self.pivot)
-        self.pivot.empty_display_size = .1
-        self.pivot.empty_display_type = 'PLAIN_AXES'
-
-        bpy.ops.object.select_all(action='DESELECT')
-
-        filepath = os.path.dirname(os.path.realpath(__file__))
-        filepath = str(Path(filepath) / "librarypixel.blend")
-        with bpy.data.libraries.load(filepath=filepath, link=False) as (data_from, data_to):
-            data_to.objects = [name for name in data_from.objects if name == self.model]
-
-        for obj in data_to.objects:
-            if obj is not None:
-                bpy.context.collection.objects.link(obj)
-                self.mesh = obj
-
-        self.mesh.parent = self.pivot
-
-        self.mesh.rotation_mode = "QUATERNION"
-        self.pivot.rotation_mode = "QUATERNION"
-
-        return self.pivot, self.mesh
+        if collection is None:
+            collection = bpy.context.collection
+
+        pivot = bpy.data.objects.new( f"{name} Pivot" if name else "empty", None )
+        collection.objects.link(pivot)
+        pivot.empty_display_size = .1
+        pivot.empty_display_type = 'PLAIN_AXES'
+
+        # copy from the cached library object instead of appending it again for every pixel;
+        # each pixel still needs its own mesh + material since create_material edits them
+        template = get_library_object(self.model)
+        mesh = template.copy()
+        del mesh["n8_library_model"]
+        if name:
+            mesh.name = name
+        mesh.data = template.data.copy()
+        for slot in mesh.material_slots:
+            if slot.material:
+                slot.material = slot.material.copy()
+        collection.objects.link(mesh)
+
+        mesh.parent = pivot
+
+        mesh.rotation_mode = "QUATERNION"
+        pivot.rotation_mode = "QUATERNION"
+
+        self.pivot_name = pivot.name
+        self.mesh_name = mesh.name
+        return pivot, mesh
 
 class N8Pixel():
     id:str = None
@@ -169,12 +237,19 @@ class N8Bone():
         self.scale = vector
 
 
+class UnsupportedFiletype(ValueError):
+    """
+    the startdata filetype is one the parser doesn't know how to scale, like Block
+    """
+    pass
+
 class N8Parser():
     data = ""
     pixels = None
     display_name = "N8Block"
-    block_origin = None
+    block_origin_name:str = None
     block_scale = None
+    num_particles = 0
 
     def __init__(self, data:str):
         pass
@@ -182,49 +257,144 @@ class N8Parser():
     def parse(self):
         pass
 
-    def create(self):
-        self.create_pixels()
-
-        return self.block_origin
+    def create(self, collection=None):
+        return self.create_pixels(collection)
 
     def join(self):
-        self.join_pixels()
+        return self.join_pixels()
 
-    def create_pixels(self):
-        print("CREATING PIXELS NOW")
-        # ensure all of the pixels are created first
-        self.block_origin = bpy.data.objects.new( self.display_name, None )
-        bpy.context.collection.objects.link(self.block_origin)
-        self.block_origin.empty_display_size = 2
-        self.block_origin.empty_display_type = 'ARROWS'
-        self.block_origin.rotation_mode = "QUATERNION"
+    @property
+    def block_origin(self):
+        """
+        looked up by name, since undo, deleting objects and loading a file free it without invalidating python references
+        """
+        return bpy.data.objects.get(self.block_origin_name) if self.block_origin_name else None
 
-        for pixel in self.pixels:
-            if self.pixels[pixel].mesh != None:
-                bpy.ops.object.delete({"selected_objects": self.pixels[pixel].mesh.mesh})
-            
-            mesh:N8Mesh = N8Mesh(self.pixels[pixel].model)
-            self.pixels[pixel].mesh = mesh
-            mesh.set_name(f"Pixel{self.pixels[pixel].id}")
+    def create_origin(self, collection):
+        block_origin = bpy.data.objects.new( self.display_name, None )
+        collection.objects.link(block_origin)
+        block_origin.empty_display_size = 2
+        block_origin.empty_display_type = 'ARROWS'
+        block_origin.rotation_mode = "QUATERNION"
 
-            mat = self.create_material(self.pixels[pixel])
-        
+        self.block_origin_name = block_origin.name
+        return block_origin
+
+    def remove_pixels(self):
+        """
+        removes whatever is left of the pixels from an earlier create
+        """
+        if all(pixel.mesh is None for pixel in self.pixels.values()):
+            return
+
+        objects = objects_by_name()
+        removed = set()
+        for pixel in self.pixels.values():
+            if pixel.mesh is not None:
+                removed.update(obj for obj in pixel.mesh.find(objects) if obj is not None)
+                pixel.mesh = None
+        bpy.data.batch_remove(removed)
+
+    def create_pixel(self, pixel_id:str, collection) -> tuple:
+        pixel = self.pixels[pixel_id]
+        pixel.mesh = N8Mesh(pixel.model)
+        pivot, mesh = pixel.mesh.create(collection=collection, name=f"Pixel{pixel.id}")
+        self.create_material(pixel, mesh)
+        return pivot, mesh
+
+    def create_pixels(self, collection=None):
+        """
+        creates and places every pixel in one go. nothing else runs in the meantime, so the created objects are used
+        directly instead of being looked up again
+        """
+        if collection is None:
+            collection = bpy.context.collection
+
+        self.remove_pixels()
+        block_origin = self.create_origin(collection)
+        preload_textures(self.texture_paths())
+
+        objects = {block_origin.name: block_origin}
         for pixel in self.pixels:
-            mesh = self.pixels[pixel].mesh
+            for obj in self.create_pixel(pixel, collection):
+                objects[obj.name] = obj
+        self.place_pixels(list(self.pixels), objects)
 
-            # parent the pivot to the parent pivot
-            if self.pixels[pixel].parent_id != "0":
-                mesh.set_parent(self.pixels[self.pixels[pixel].parent_id].mesh.get_pivot())
-            else:
-                mesh.set_parent(self.block_origin)
+        return block_origin
 
-            mesh.set_position(self.pixels[pixel].position)
-            mesh.set_offset(self.pixels[pixel].bones["bone02"].position)
-            mesh.set_rotation(self.pixels[pixel].rotation)
-            mesh.set_local_rotation(self.pixels[pixel].bones["bone02"].rotation)
-            mesh.set_scale(self.pixels[pixel].bones["bone02"].scale)
+    def create_steps(self, collection=None):
+        """
+        creates the pixels one at a time, yielding (done, total) after each one so the work can be spread out.
+        closing the generator early still parents and positions every pixel created up to that point
+        """
+        print("CREATING PIXELS NOW")
+        if collection is None:
+            collection = bpy.context.collection
 
-        return self.block_origin
+        # ensure all of the pixels are created first
+        self.remove_pixels()
+        self.create_origin(collection)
+        preload_textures(self.texture_paths())
+
+        created = []
+        try:
+            for pixel in self.pixels:
+                self.create_pixel(pixel, collection)
+                created.append(pixel)
+
+                yield len(created), len(self.pixels)
+        finally:
+            # the editor runs in between the steps, so anything created earlier may have been deleted since
+            self.place_pixels(created, objects_by_name())
+
+    def place_pixels(self, created:list, objects:dict):
+        """
+        parents and positions the created pixels, skipping any that aren't in objects anymore. the world matrix of
+        every pivot is built up through its parent chain in a single batched pass, the same way cells resolve their
+        attach records
+        """
+        block_origin = objects.get(self.block_origin_name)
+        found = {}
+        for pixel in created:
+            pivot, mesh = self.pixels[pixel].mesh.find(objects)
+            if pivot is not None:
+                found[pixel] = (pivot, mesh)
+
+        created = [pixel for pixel in created if pixel in found]
+        if not created:
+            return
+
+        pixels = [self.pixels[pixel] for pixel in created]
+        lookup = {pixel: i for i, pixel in enumerate(created)}
+
+        # pixels whose parent wasn't created (or is the root) go straight under the block origin
+        parents = [
+            lookup.get(pixel.parent_id, -1) if pixel.parent_id != "0" else -1
+            for pixel in pixels
+        ]
+
+        local = hierarchy.local_matrices(
+            [pixel.position for pixel in pixels],
+            [tuple(pixel.rotation) for pixel in pixels],
+        )
+        world, parent_inverse, resolved, in_loop, under_loop = hierarchy.resolve(local, parents)
+        for i in np.flatnonzero(in_loop | under_loop):
+            print(f"Pixel {pixels[i].id} is attached in or under a loop, leaving it under the block origin")
+
+        offsets = hierarchy.local_matrices(
+            [pixel.bones["bone02"].position for pixel in pixels],
+            [tuple(pixel.bones["bone02"].rotation) for pixel in pixels],
+            [pixel.bones["bone02"].scale for pixel in pixels],
+        )
+
+        # every pivot and mesh gets its whole transform written once
+        for i, pixel in enumerate(created):
+            pivot, mesh = found[pixel]
+            pivot.parent = found[created[resolved[i]]][0] if resolved[i] >= 0 else block_origin
+            pivot.matrix_parent_inverse = Matrix(parent_inverse[i].tolist())
+            pivot.matrix_basis = Matrix(world[i].tolist())
+            if mesh is not None:
+                mesh.matrix_basis = Matrix(offsets[i].tolist())
     
     def convert_texture_name(self, name:str):
         image_path = re.sub(r"\.dds$", ".png", name.lower().strip())
@@ -235,20 +405,29 @@ class N8Parser():
         #bpy.ops.object.particle_system_add()
         pass
 
-    def load_texture(self, original_path:str):
-        
+    def texture_path(self, original_path:str) -> Path:
         path_full = os.path.dirname(os.path.realpath(__file__))
 
         image_path = self.convert_texture_name(original_path)
-        image_path = str(Path(path_full) / "textures" / Path(image_path))
-        bpy.data.images.load(image_path, check_existing=True)
-        filename = Path(image_path).stem + Path(image_path).suffix
-        image = bpy.data.images[filename]
+        return Path(path_full) / "textures" / Path(image_path)
+
+    def texture_paths(self) -> set:
+        return {self.texture_path(self.pixels[pixel].texture) for pixel in self.pixels}
+
+    def load_texture(self, original_path:str):
+        image_path = str(self.texture_path(original_path))
+        image = get_cached_texture(image_path)
+        if image is not None:
+            return image
+
+        # images with the same filename from different folders get suffixed names, so use what load hands back
+        image = bpy.data.images.load(image_path, check_existing=True)
         image.pack()
+        cache_texture(image_path, image)
         return image
 
-    def create_material(self, pixel:N8Pixel):
-        mat = pixel.mesh.mesh.active_material
+    def create_material(self, pixel:N8Pixel, obj):
+        mat = obj.active_material
         
         # viewport display in solid modes
         mat.diffuse_color = (pixel.diffuse.r, pixel.diffuse.g, pixel.diffuse.b, pixel.diffuse_alpha)
@@ -278,38 +457,73 @@ class N8Parser():
 
         return mat
 
-    def join_pixels(self):
-        meshes = [self.pixels[x].mesh.mesh for x in self.pixels]
-        pivots = [self.pixels[x].mesh.pivot for x in self.pixels]
-
-        bpy.ops.object.select_all(action='DESELECT')
-        for mesh in meshes:
-            mesh.select_set(True)
-        bpy.context.view_layer.objects.active = meshes[0]
-        ctx_mesh = bpy.context.copy()
-
-        bpy.ops.object.select_all(action='DESELECT')
-        for pivot in pivots:
-            pivot.select_set(True)
-        bpy.context.view_layer.objects.active = pivots[0]
-        ctx_pivot = bpy.context.copy()
-
-        bpy.ops.object.select_all(action='DESELECT')
-
-        bpy.ops.object.parent_clear(ctx_mesh, type='CLEAR_KEEP_TRANSFORM')
-
-        for mesh in meshes:
-            mesh.parent = self.block_origin
-
-        bpy.ops.object.join(ctx_mesh)
-        bpy.ops.object.delete(ctx_pivot)
-
-        temp_cursor_loc = bpy.context.scene.cursor.location
-        bpy.context.scene.cursor.location = (0,0,0)
-        bpy.ops.object.origin_set(ctx_mesh, type='ORIGIN_CURSOR', center='MEDIAN')
-        bpy.context.scene.cursor.location = temp_cursor_loc
+    def material_key(self, pixel:N8Pixel) -> tuple:
+        """
+        everything create_material reads from the pixel, so pixels with the same key end up with identical materials
+        """
+        return (
+            tuple(pixel.diffuse), pixel.diffuse_alpha,
+            tuple(pixel.emission), pixel.emission_alpha,
+            str(self.texture_path(pixel.texture)),
+        )
 
-        pass
+    def join_pixels(self, name:str = None):
+        """
+        joins every created pixel into a single mesh parented to the block origin using only bpy.data, merging pixels
+        with identical materials. the pixels and their pivots are removed afterwards
+        """
+        if name is None:
+            name = self.display_name
+
+        objects = objects_by_name()
+        block_origin = objects.get(self.block_origin_name)
+        if block_origin is None:
+            print("The block origin is gone, leaving the pixels as they are")
+            return None
+
+        materials = []
+        material_indices = {}
+        removed = set()
+
+        bm = bmesh.new()
+        for pixel in self.pixels.values():
+            if pixel.mesh is None:
+                continue
+
+            pivot, obj = pixel.mesh.find(objects)
+            pixel.mesh = None
+            if pivot is not None:
+                removed.add(pivot)
+            if obj is None:
+                continue
+
+            key = self.material_key(pixel)
+            if key not in material_indices:
+                material_indices[key] = len(materials)
+                materials.append(obj.active_material)
+            elif obj.active_material is not None:
+                removed.add(obj.active_material)
+
+            mesh = obj.data.copy()
+            mesh.transform(matrix_to_root(obj, block_origin))
+            mesh.polygons.foreach_set("material_index", [material_indices[key]] * len(mesh.polygons))
+            bm.from_mesh(mesh)
+
+            removed.update((mesh, obj.data, obj))
+
+        joined = bpy.data.meshes.new(name)
+        bm.to_mesh(joined)
+        bm.free()
+        for material in materials:
+            joined.materials.append(material)
+
+        block = bpy.data.objects.new(name, joined)
+        for collection in block_origin.users_collection:
+            collection.objects.link(block)
+        block.parent = block_origin
+
+        bpy.data.batch_remove(removed)
+        return block
 
     def is_image_alpha(self, name:str):
         # unfortunately i don't have a way to detect this so i'm just manually specifying
@@ -441,6 +655,9 @@ class StartData(N8Parser):
             elif hold_or_wear.lower() == "2":
                 hold_or_wear = "gun" # never implemented originally
         
+        if self.block_scale is None:
+            raise UnsupportedFiletype(f"filetype {split[2].strip()} isn't supported")
+
         # there's a bug in n8maker that saves without scale if you don't explicitly set press enter on the field
         # so some of the files don't have it set. the default was 2 i guess.
         if self.block_scale == "":
@@ -545,11 +762,11 @@ class StartData(N8Parser):
 
                 pixels[pixel.id] = pixel
             
-            num_particles = int(file.readline().strip())
+            self.num_particles = int(file.readline().strip())
 
-            print(f"Found {num_particles} particles to parse in the file")
+            print(f"Found {self.num_particles} particles to parse in the file")
 
-            for particle_id in range(0, num_particles):
+            for particle_id in range(0, self.num_particles):
                 print("UNSUPPORTED PARTICLES", particle_id)
         
         return pixels
@@ -557,6 +774,48 @@ class StartData(N8Parser):
     
 
 
+def parse_file(filepath:str, context=None) -> (N8Parser,str):
+    """
+    runs only the read and parse stages, returning the parser (or None if the format isn't supported) and the file version
+    """
+    parser = None
+    data, version = load_file(filepath, context)
+
+    if version == "StartData":
+        parser = StartData(data)
+        parser.parse()
+    elif version == "BEGIN!":
+        print("Begin Data!!!")
+
+    return parser, version
+
+def create(collection, parser:N8Parser, block_name:str, join:bool = False):
+    """
+    runs the create stage for an already parsed file
+    """
+    block = parser.create(collection)
+    if join:
+        parser.join()
+
+    MESH_CACHE[block_name] = parser.block_origin_name
+    return block
+
+def load_steps(collection, filepath:str, join:bool = False):
+    """
+    same as load, but yields (done, total) after each pixel so the caller can spread the import out and stop it early.
+    pixels always go into the given collection, even if the user makes another one active while this is running
+    """
+    block_name = Path(filepath).stem
+    parser, version = parse_file(filepath)
+    if not parser:
+        return
+
+    yield from parser.create_steps(collection)
+
+    if join:
+        parser.join()
+    MESH_CACHE[block_name] = parser.block_origin_name
+
 def load(context, filepath:str, scale:float = 1.0, join:bool = False):
     #if mesh_name in MESH_CACHE:
     #    self.mesh = MESH_CACHE[self.mesh_name].copy()
@@ -565,7 +824,6 @@ def load(context, filepath:str, scale:float = 1.0, join:bool = False):
 
     block_name = Path(filepath).stem
     block = None
-    parser = None
     #if block_name in MESH_CACHE:
         #print(f"Found {block_name} in the cache")
         #block = MESH_CACHE[block_name]
@@ -575,22 +833,9 @@ def load(context, filepath:str, scale:float = 1.0, join:bool = False):
         #bpy.ops.object.select_grouped(type='CHILDREN_RECURSIVE')
         #bpy.context.view_layer.objects.active = block
     #else:
-    data, version = load_file(filepath, context)
-
-    if version == "StartData":
-        parser = StartData(data)
-    elif version == "BEGIN!":
-        print("Begin Data!!!")
-    else:
-        return {'FINISHED'}
+    parser, version = parse_file(filepath, context)
 
     if parser:
+        block = create(context.collection, parser, block_name, join)
 
-        parser.parse()
-        block = parser.create()
-        if join:
-            parser.join()
-    
-        MESH_CACHE[block_name] = block
-
-    return {'FINISHED'}, block
\ No newline at end of file
+    return {'FINISHED'}, block
@@ -0,0 +1,154 @@
+"""
+Streaming reader for the tronics, attach and wire sections of ncd cell files.
+
+Nothing in here touches bpy, so circuit analysis scripts can walk the tronics and wires of a cell
+without importing any of its geometry.
+"""
+import mmap, re
+from typing import NamedTuple
+
+SECTIONS = ("tronics", "attach", "wire")
+SECTION_PATTERN = re.compile(rb"^(tronics|attach|wire)\r?$", re.MULTILINE)
+
+class Tronic(NamedTuple):
+    # 486061:cdata:fishman:940.099,0.033,-115.096:0.7071068,1.545431E-08,-0.7071067,1.545431E-08:fishman:
+    index: str
+    kind: str
+    name: str
+    position: tuple
+    rotation: tuple
+    data: str
+
+class Wire(NamedTuple):
+    # 486053,8,486054,9
+    source: str
+    source_port: int
+    target: str
+    target_port: int
+
+def parse_tronic(line:str) -> Tronic:
+    index, kind, name, position, rotation, data = line.split(sep=":", maxsplit=5)
+    # the data field is always terminated with a trailing colon
+    if data.endswith(":"):
+        data = data[:-1]
+
+    return Tronic(
+        index, kind, name,
+        tuple(float(x) for x in position.split(sep=",")),
+        tuple(float(x) for x in rotation.split(sep=",")),
+        data,
+    )
+
+def parse_wire(line:str) -> Wire:
+    source, source_port, target, target_port = line.split(sep=",")
+    return Wire(source, int(source_port), target, int(target_port))
+
+def join_wrapped(lines):
+    """
+    yields the stripped, non-blank lines. some saves hard wrap long lines after a minus sign, sometimes with a blank
+    line in between, so those get glued back together first
+    """
+    wrapped = ""
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        stripped = wrapped + stripped
+        if stripped.endswith("-"):
+            wrapped = stripped
+            continue
+        wrapped = ""
+
+        yield stripped
+
+def index_sections(filepath:str) -> dict:
+    """
+    finds where each section starts in a single pass over the file.
+    returns the byte offset of the first line after every section header, keyed by section name
+    """
+    offsets = {}
+    with open(filepath, mode='rb') as n8file:
+        try:
+            data = mmap.mmap(n8file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # can't map an empty file
+            return offsets
+
+        with data:
+            for match in SECTION_PATTERN.finditer(data):
+                name = match.group(1).decode()
+                if name not in offsets:
+                    offsets[name] = min(match.end() + 1, len(data))
+
+    return offsets
+
+def iter_section(filepath:str, section:str, offsets:dict = None):
+    """
+    yields the stripped lines of a single section, seeking straight to it
+    """
+    if offsets is None:
+        offsets = index_sections(filepath)
+    if section not in offsets:
+        return
+
+    with open(filepath, mode='rb') as n8file:
+        n8file.seek(offsets[section])
+        for line in join_wrapped(line.decode(errors='ignore') for line in n8file):
+            if line in SECTIONS:
+                return
+            yield line
+
+def iter_tronics(filepath:str, offsets:dict = None):
+    for line in iter_section(filepath, "tronics", offsets):
+        yield parse_tronic(line)
+
+def iter_attach(filepath:str, offsets:dict = None):
+    """
+    yields (child, parent) pairs
+    """
+    for line in iter_section(filepath, "attach", offsets):
+        child, parent = line.split(sep=":")
+        yield child, parent
+
+def iter_wires(filepath:str, offsets:dict = None):
+    for line in iter_section(filepath, "wire", offsets):
+        yield parse_wire(line)
+
+class WireGraph:
+    """
+    adjacency lists of the wires between tronics, in both directions
+    """
+    tronics = None
+    outputs = None
+    inputs = None
+
+    def __init__(self, tronics = (), wires = ()):
+        self.tronics = {}
+        self.outputs = {}
+        self.inputs = {}
+
+        for tronic in tronics:
+            self.tronics[tronic.index] = tronic
+        for wire in wires:
+            self.add_wire(wire)
+
+    def __repr__(self):
+        return f"WireGraph | tronics: {len(self.tronics)} | wires: {sum(len(x) for x in self.outputs.values())}"
+
+    def add_wire(self, wire:Wire):
+        self.outputs.setdefault(wire.source, []).append(wire)
+        self.inputs.setdefault(wire.target, []).append(wire)
+
+    def neighbours(self, index:str) -> set:
+        """
+        every tronic wired to the given one, regardless of direction
+        """
+        return (
+            {wire.target for wire in self.outputs.get(index, ())} |
+            {wire.source for wire in self.inputs.get(index, ())}
+        )
+
+def load_wire_graph(filepath:str) -> WireGraph:
+    offsets = index_sections(filepath)
+    return WireGraph(iter_tronics(filepath, offsets), iter_wires(filepath, offsets))
@@ -0,0 +1,195 @@
+"""
+Dry run of the importers: runs only the read and parse stages of import_n8png and import_n8ncd and
+reports what a full import would run into, without creating anything in the scene.
+
+From the command line (with blender available as the bpy module, or inside blender with --background):
+    python -m io_n8png.scan_n8 saves/ data/stuff/
+    blender --background --python-expr "from io_n8png import scan_n8; scan_n8.main()" -- saves/
+"""
+import os, io, sys
+import argparse
+import contextlib
+from pathlib import Path
+
+import bpy
+from . import import_n8png, import_n8ncd
+
+LIBRARY_MODELS = None
+
+class ScanReport:
+    filepath:str = None
+    version:str = None
+    pixels:int = 0
+    particles:int = 0
+    bones:int = 0
+    blocks:int = 0
+    tronics:int = 0
+    wires:int = 0
+    problems:list = None
+
+    def __init__(self, filepath:str):
+        self.filepath = filepath
+        self.problems = []
+
+    def __repr__(self):
+        summary = f"{self.filepath} | {self.version} | pixels: {self.pixels} | particles: {self.particles} | bones: {self.bones}"
+        if self.version == "ncd":
+            summary += f" | blocks: {self.blocks} | tronics: {self.tronics} | wires: {self.wires}"
+        return "\n    ".join([summary] + self.problems)
+
+    def add_problem(self, problem:str):
+        if problem not in self.problems:
+            self.problems.append(problem)
+
+def library_models() -> set:
+    """
+    names of the models available in librarypixel.blend; only the names are read, nothing is appended
+    """
+    global LIBRARY_MODELS
+    if LIBRARY_MODELS is None:
+        filepath = os.path.dirname(os.path.realpath(__file__))
+        filepath = str(Path(filepath) / "librarypixel.blend")
+        with bpy.data.libraries.load(filepath=filepath, link=False) as (data_from, data_to):
+            LIBRARY_MODELS = set(data_from.objects)
+
+    return LIBRARY_MODELS
+
+def scan_png(filepath:str) -> ScanReport:
+    report = ScanReport(filepath)
+
+    try:
+        # the parsers are chatty, and the output is meaningless without the import
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser, report.version = import_n8png.parse_file(filepath)
+    except KeyError as e:
+        report.version = "StartData"
+        report.add_problem(f"unknown model {e}")
+        return report
+    except import_n8png.UnsupportedFiletype as e:
+        report.version = "StartData"
+        report.add_problem(str(e))
+        return report
+    except OSError as e:
+        report.add_problem(f"couldn't read the file: {e}")
+        return report
+    except (ValueError, IndexError, TypeError) as e:
+        report.add_problem(f"couldn't parse the file: {e!r}")
+        return report
+
+    if report.version == "BEGIN!":
+        report.add_problem("BEGIN! format isn't supported")
+    elif parser is None:
+        report.add_problem("not an n8 model file")
+
+    if parser is None:
+        return report
+
+    report.pixels = len(parser.pixels)
+    report.particles = parser.num_particles
+
+    for pixel in parser.pixels.values():
+        report.bones += len(pixel.bones)
+
+        if pixel.model not in library_models():
+            report.add_problem(f"model {pixel.model} isn't in librarypixel.blend")
+        if not parser.texture_path(pixel.texture).is_file():
+            report.add_problem(f"missing texture {pixel.texture}")
+
+    return report
+
+def scan_ncd(filepath:str, cache:dict = None) -> ScanReport:
+    """
+    scans the cell along with every stuff model it references; cache is shared between cells so each model is only parsed once
+    """
+    if cache is None:
+        cache = {}
+
+    report = ScanReport(filepath)
+    report.version = "ncd"
+    cell = import_n8ncd.N8Cell()
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cell.parse(filepath)
+    except OSError as e:
+        report.add_problem(f"couldn't read the file: {e}")
+        return report
+    except (ValueError, IndexError, TypeError) as e:
+        report.add_problem(f"couldn't parse the file: {e!r}")
+        return report
+
+    report.blocks = len(cell.blocks)
+    report.tronics = len(cell.tronics)
+    report.wires = len(cell.wires)
+
+    for section, line in cell.skipped:
+        report.add_problem(f"skipped malformed {section} line {line}")
+
+    for block in cell.blocks.values():
+        path = block.mesh_path()
+        if not path.is_file():
+            report.add_problem(f"missing data/stuff/{path.name} for {block.mesh_name}")
+            continue
+
+        if path not in cache:
+            cache[path] = scan_png(str(path))
+        stuff = cache[path]
+
+        report.pixels += stuff.pixels
+        report.particles += stuff.particles
+        report.bones += stuff.bones
+        for problem in stuff.problems:
+            report.add_problem(f"{block.mesh_name}: {problem}")
+
+    return report
+
+def scan_directory(directory:str, recursive:bool = True, cache:dict = None) -> list:
+    if cache is None:
+        cache = {}
+
+    reports = []
+
+    pattern = "**/*" if recursive else "*"
+    for path in sorted(Path(directory).glob(pattern)):
+        extension = path.suffix.lower()
+        if extension == ".png":
+            report = scan_png(str(path))
+            if report.version == "UNKNOWN":
+                # plain images (screenshots etc) sit next to the models in the saves
+                continue
+            reports.append(report)
+        elif extension == ".ncd":
+            reports.append(scan_ncd(str(path), cache))
+
+    return reports
+
+def main(argv:list = None):
+    if argv is None:
+        # blender passes the script arguments after --
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+
+    arg_parser = argparse.ArgumentParser(description="Scan n8 models and cells for anything the importer can't handle.")
+    arg_parser.add_argument("paths", nargs="+", help="model/cell files or directories to scan")
+    arg_parser.add_argument("--problems-only", action="store_true", help="only list files with problems")
+    args = arg_parser.parse_args(argv)
+
+    reports = []
+    cache = {}
+    for path in args.paths:
+        if os.path.isdir(path):
+            reports += scan_directory(path, cache=cache)
+        elif path.lower().endswith(".ncd"):
+            reports.append(scan_ncd(path, cache))
+        else:
+            reports.append(scan_png(path))
+
+    for report in reports:
+        if report.problems or not args.problems_only:
+            print(report)
+
+    failed = sum(1 for report in reports if report.problems)
+    print(f"Scanned {len(reports)} files, {failed} with problems")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Prebuilt library of the data/stuff models so cell imports can instance blocks instead of rebuilding them from the pngs.
+
+Every model gets its own collection holding a single joined mesh with duplicate materials merged. The collections are
+written to data/stuff_library.blend and data/stuff_library.json records a stamp for each model's source png and the
+textures it uses, so anything that changed since the last build falls back to the regular png import.
+
+The build can be run from File > Import > Build N8* Stuff Library or in the background:
+    blender --background --python-expr "from io_n8png import stuff_library; stuff_library.build()"
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+
+import bpy
+from . import import_n8png
+
+# bump whenever the way the library is built changes so older libraries get ignored
+LIBRARY_VERSION = 2
+
+ADDON_PATH = Path(os.path.dirname(os.path.realpath(__file__)))
+STUFF_PATH = ADDON_PATH / "data" / "stuff"
+TEXTURES_PATH = ADDON_PATH / "textures"
+LIBRARY_PATH = ADDON_PATH / "data" / "stuff_library.blend"
+MANIFEST_PATH = ADDON_PATH / "data" / "stuff_library.json"
+
+def file_hash(filepath:Path) -> str:
+    with open(filepath, mode='rb') as source:
+        return hashlib.sha1(source.read()).hexdigest()
+
+def source_stamp(model_path:Path, texture_paths, hashes:dict = None) -> str:
+    """
+    covers the model png and every texture it references, since the textures get packed into the library as well.
+    hashes is shared between calls so textures used by several models are only read once
+    """
+    if hashes is None:
+        hashes = {}
+
+    stamp = hashlib.sha1(str(LIBRARY_VERSION).encode())
+    for path in [model_path] + sorted(texture_paths):
+        if path not in hashes:
+            hashes[path] = file_hash(path)
+        stamp.update(hashes[path].encode())
+    return stamp.hexdigest()
+
+def load_manifest() -> dict:
+    """
+    returns the collection name, textures and stamp of every model in the library, or nothing if the library as a whole is missing or out of date
+    """
+    if not LIBRARY_PATH.is_file() or not MANIFEST_PATH.is_file():
+        return {}
+
+    with open(MANIFEST_PATH, mode='r') as manifest_file:
+        manifest = json.load(manifest_file)
+
+    # the pixel shapes come from librarypixel.blend, so changing it invalidates everything
+    if manifest.get("version") != LIBRARY_VERSION:
+        return {}
+    if manifest.get("librarypixel") != file_hash(ADDON_PATH / "librarypixel.blend"):
+        return {}
+
+    return manifest.get("models", {})
+
+def link_collections(model_paths) -> dict:
+    """
+    links the library collection of every model whose stamp still matches its source png and textures.
+    returns the linked collections keyed by model path; anything missing has to be imported from the png instead
+    """
+    models = load_manifest()
+    current = {}
+    hashes = {}
+    for model_path in set(model_paths):
+        model = models.get(model_path.stem)
+        if model is None:
+            continue
+
+        try:
+            stamp = source_stamp(model_path, [TEXTURES_PATH / texture for texture in model["textures"]], hashes)
+        except OSError:
+            # the png or one of its textures is gone
+            continue
+        if stamp == model["stamp"]:
+            current[model["collection"]] = model_path
+
+    if not current:
+        return {}
+
+    # linking an already linked collection hands back the existing one
+    with bpy.data.libraries.load(filepath=str(LIBRARY_PATH), link=True) as (data_from, data_to):
+        data_to.collections = [name for name in data_from.collections if name in current]
+
+    return {
+        current[collection.name]: collection
+        for collection in data_to.collections if collection is not None
+    }
+
+def instance_collection(collection, library_collection, name:str = None):
+    block = bpy.data.objects.new(name or library_collection.name, None)
+    block.instance_type = 'COLLECTION'
+    block.instance_collection = library_collection
+    block.empty_display_size = 2
+    block.empty_display_type = 'ARROWS'
+    block.rotation_mode = "QUATERNION"
+    collection.objects.link(block)
+    return block
+
+def join_block(parser:import_n8png.N8Parser, name:str):
+    """
+    joins the pixels into a single mesh and removes the block origin, leaving the mesh at the root of the collection
+    """
+    block = parser.join_pixels(name)
+    bpy.data.batch_remove({parser.block_origin})
+    return block
+
+def library_ids() -> set:
+    """
+    everything building a model can create, apart from the images which stay cached for the other models
+    """
+    return set(bpy.data.objects) | set(bpy.data.meshes) | set(bpy.data.materials)
+
+def build(stuff_path:Path = STUFF_PATH) -> (int,int):
+    """
+    imports every model in data/stuff once and writes them out as the prebuilt library.
+    returns how many models were built and how many were skipped
+    """
+    collections = set()
+    models = {}
+    hashes = {}
+    skipped = 0
+
+    for model_path in sorted(Path(stuff_path).glob("*.png")):
+        before = library_ids()
+        collection = None
+        try:
+            parser, version = import_n8png.parse_file(str(model_path))
+            if parser is None:
+                skipped += 1
+                continue
+
+            collection = bpy.data.collections.new(model_path.stem)
+            parser.create(collection)
+            join_block(parser, model_path.stem)
+        except Exception as e:
+            # usually an unsupported filetype or a texture that doesn't exist, like the team blocks that reference hats
+            print(f"Skipping {model_path.name}: {e!r}")
+            removed = library_ids() - before
+            if collection is not None:
+                removed.add(collection)
+            bpy.data.batch_remove(removed)
+            skipped += 1
+            continue
+
+        texture_paths = sorted(parser.texture_paths())
+        collections.add(collection)
+        models[model_path.stem] = {
+            # the collection gets a suffix if the open file already has one with the same name
+            "collection": collection.name,
+            "textures": [texture_path.relative_to(TEXTURES_PATH).as_posix() for texture_path in texture_paths],
+            "stamp": source_stamp(model_path, texture_paths, hashes),
+        }
+
+    bpy.data.libraries.write(str(LIBRARY_PATH), collections, fake_user=True, compress=True)
+
+    with open(MANIFEST_PATH, mode='w') as manifest_file:
+        json.dump({
+            "version": LIBRARY_VERSION,
+            "librarypixel": file_hash(ADDON_PATH / "librarypixel.blend"),
+            "models": models,
+        }, manifest_file, indent=4)
+
+    # everything now lives in the library file, so clean up the copies in the current file
+    removed = set(collections)
+    for collection in collections:
+        for obj in collection.objects:
+            removed.add(obj)
+            removed.add(obj.data)
+            removed.update(material for material in obj.data.materials if material is not None)
+    bpy.data.batch_remove(removed)
+
+    print(f"Built {len(models)} models into {LIBRARY_PATH}, skipped {skipped}")
+    return len(models), skipped